@@ -1,25 +1,48 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import os
+import logging
 import re
-from typing import Dict, Any, List, Optional, Tuple
+import base64
+import binascii
+import unicodedata
+from itertools import product
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from datetime import datetime
+from urllib.parse import unquote
 import asyncio
 import uuid
+import json
+import msgspec
+import ahocorasick
+import regex
+import redis.asyncio
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# LangChain imports for history formatting
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
+# Debug output is only formatted when LOG_LEVEL=DEBUG; unknown levels fall back to INFO
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+_log_level = logging.getLevelName(LOG_LEVEL)
+logging.basicConfig(
+    level=_log_level if isinstance(_log_level, int) else logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("finagent")
+if not isinstance(_log_level, int):
+    logger.warning("⚠️ Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+# httpx logs every outbound request at INFO; keep it quiet unless debugging
+if logging.root.level > logging.DEBUG:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Local services
-from services.nbu_api import fetch_currency_rates, format_currency_data_for_ai, NBUAPIError
+from services.nbu_api import fetch_currency_rates_raw, NBUAPIError, warm_up_client, close_client
 from services.agent_service import AgentService
 
-app = FastAPI(title="AI Agent Backend", version="1.0.0")
+app = FastAPI(title="AI Agent Backend", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -30,118 +53,244 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_event():
+    """Pre-warm the pooled NBU API connection"""
+    await warm_up_client()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled NBU API and Redis connections"""
+    await close_client()
+    await _redis.aclose()
+
 # Initialize Agent Service
 agent_service = AgentService()
 
-# In-memory session storage (in production, use Redis or database)
-chat_sessions: Dict[str, List[Dict[str, str]]] = {}
+# Redis-backed session storage so history is shared across workers and hosts
+# Keep only the last 20 messages per session to prevent memory issues
+MAX_HISTORY_MESSAGES = 20
+SESSION_TTL_SECONDS = 86400
+_redis = redis.asyncio.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+
+# History entries are stored as compact [role_code, content] pairs
+_USER, _ASSISTANT = 0, 1
+ROLE_NAMES = ("user", "assistant")
+
+def _history_key(session_id: str) -> str:
+    return f"session:{session_id}"
 
-def get_or_create_session(session_id: Optional[str] = None) -> str:
+def _marker_key(session_id: str) -> str:
+    # Marks a session as existing even before its first message is stored
+    return f"session_active:{session_id}"
+
+async def get_or_create_session(session_id: Optional[str] = None) -> str:
     """Get existing session or create a new one"""
-    if session_id and session_id in chat_sessions:
+    if session_id and await _redis.exists(_marker_key(session_id)):
         return session_id
     
     # Create new session
     new_session_id = str(uuid.uuid4())
-    chat_sessions[new_session_id] = []
+    await _redis.set(_marker_key(new_session_id), datetime.utcnow().isoformat(), ex=SESSION_TTL_SECONDS)
     return new_session_id
 
-def get_chat_history(session_id: str) -> List[Dict[str, str]]:
-    """Get chat history for a session"""
-    return chat_sessions.get(session_id, [])
+async def get_chat_history(session_id: str) -> List[Tuple[int, str]]:
+    """Get chat history for a session as (role_code, content) pairs"""
+    entries = await _redis.lrange(_history_key(session_id), 0, -1)
+    return [tuple(json.loads(entry)) for entry in entries]
 
-def add_to_chat_history(session_id: str, user_message: str, ai_response: str):
+async def add_to_chat_history(session_id: str, user_message: str, ai_response: str):
     """Add a conversation turn to the chat history"""
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = []
-    
-    chat_sessions[session_id].extend([
-        {"role": "user", "content": user_message},
-        {"role": "assistant", "content": ai_response}
-    ])
-    
-    # Keep only last 20 messages to prevent memory issues
-    if len(chat_sessions[session_id]) > 20:
-        chat_sessions[session_id] = chat_sessions[session_id][-20:]
-
-def format_history_for_langchain(history: List[Dict[str, str]]) -> List:
-    """Convert our history format to LangChain format"""
-    langchain_history = []
-    for message in history:
-        if message["role"] == "user":
-            langchain_history.append(HumanMessage(content=message["content"]))
-        elif message["role"] == "assistant":
-            langchain_history.append(AIMessage(content=message["content"]))
-        else:
-            langchain_history.append(SystemMessage(content=message["content"]))
-    return langchain_history
+    history_key = _history_key(session_id)
+    
+    async with _redis.pipeline(transaction=True) as pipe:
+        pipe.rpush(
+            history_key,
+            json.dumps((_USER, user_message)),
+            json.dumps((_ASSISTANT, ai_response))
+        )
+        # Redis drops the oldest messages server-side
+        pipe.ltrim(history_key, -MAX_HISTORY_MESSAGES, -1)
+        pipe.expire(history_key, SESSION_TTL_SECONDS)
+        pipe.set(_marker_key(session_id), datetime.utcnow().isoformat(), ex=SESSION_TTL_SECONDS)
+        await pipe.execute()
+
+def format_history_for_agent(history: Iterable[Tuple[int, str]]) -> List[Dict[str, str]]:
+    """Convert our history format to OpenAI chat messages"""
+    return [{"role": ROLE_NAMES[role], "content": content} for role, content in history]
 
 # Basic Prompt Injection Protection
-def detect_prompt_injection(user_input: str) -> Tuple[bool, List[str]]:
+def _expand(*slots: List[str]) -> List[str]:
+    """Expand word slots into every literal phrase variant ("" marks an optional word)"""
+    return [" ".join(word for word in combo if word) for combo in product(*slots)]
+
+# Literal keyphrases matched in a single Aho-Corasick pass, grouped by the attack they indicate.
+# Inputs are case-folded and whitespace-collapsed before scanning, so phrases use single spaces.
+INJECTION_KEYPHRASES: Dict[str, List[str]] = {
+    # Role override attempts
+    "ignore instructions": _expand(["ignore"], ["all", ""], ["previous", ""], ["instruction"]),
+    "forget instructions": _expand(["forget"], ["all", ""], ["previous", ""], ["instruction"]),
+    "you are now": _expand(["you are now"], ["a", ""], ["different", ""], ["ai", "assistant", "bot"]),
+    "new instructions": ["new instruction"],
+    "override instructions": _expand(["override"], ["previous", ""], ["system", ""], ["instruction", "prompt"]),
+    
+    # System prompt manipulation
+    "end of instructions": _expand(["end"], ["of", ""], ["system", ""], ["instruction", "prompt"]),
+    "system prompt ends": _expand(["system"], ["prompt", "message"], ["end", "over"]),
+    "delimiter end": ["---end", "--- end"],
+    "stop being": _expand(["stop being"], ["a", "an", ""], ["ai", "assistant", "bot"]),
+    
+    # Tool bypass attempts
+    "don't use tools": _expand(["don't", "dont"], ["use"], ["any", ""], ["tool"]),
+    "never use tools": _expand(["never use"], ["the", ""], ["currency", "tool", "function"]),
+    "without using tools": _expand(["without using"], ["any", ""], ["tool"]),
+    "make up data": _expand(["make up"], ["random", ""], ["number", "data", "rate"]),
+    "just say": _expand(["just"], ["say", "tell", "respond"]),
+    
+    # Prompt structure manipulation
+    "role prefix": [f"{role}{sep}:" for role in ("human", "assistant", "user", "system") for sep in ("", " ")],
+    
+    # Direct instruction override
+    "instead of using tools": ["instead of using tool"],
+    "pretend": ["pretend to be", "pretend you are"],
+}
+
+# Structural patterns that cannot be expressed as literal phrases, most frequent first
+STRUCTURAL_PATTERNS = [
+    r"respond\s+with\s+['\"].*['\"]",
+    r"say\s+exactly\s+['\"].*['\"]",
+    r"<\|.*?\|>",  # Special tokens
+    r"\[(?:system|user|assistant)\]",
+]
+
+# Number of distinct patterns at which input is blocked; scanning stops once it is reached
+INJECTION_BLOCK_THRESHOLD = 2
+
+def _build_automaton() -> ahocorasick.Automaton:
+    """Build the keyphrase automaton once at import time"""
+    automaton = ahocorasick.Automaton()
+    for label, phrases in INJECTION_KEYPHRASES.items():
+        for phrase in phrases:
+            automaton.add_word(phrase, label)
+    automaton.make_automaton()
+    return automaton
+
+_AUTOMATON = _build_automaton()
+
+# Compiled with the `regex` module so each search can be bounded by a timeout on untrusted input
+REGEX_TIMEOUT_SECONDS = 0.01
+_COMPILED_PATTERNS: List[Tuple[str, regex.Pattern]] = [
+    (pattern, regex.compile(pattern, regex.IGNORECASE)) for pattern in STRUCTURAL_PATTERNS
+]
+
+# Zero-width and BOM characters used to split keywords without changing how they render
+_ZERO_WIDTH_TABLE = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"))
+
+_BASE64_RUN = re.compile(r"[A-Za-z0-9+/=]{24,}")
+_PERCENT_ESCAPE = re.compile(r"%[0-9A-Fa-f]{2}")
+
+def normalize_user_input(user_input: str) -> str:
+    """
+    Normalize user input once before detection and sanitization:
+    NFKC Unicode fold, zero-width character removal and whitespace collapse
+    """
+    normalized = unicodedata.normalize("NFKC", user_input).translate(_ZERO_WIDTH_TABLE)
+    return " ".join(normalized.split())
+
+def _decode_obfuscated(normalized: str) -> List[str]:
+    """Decode Base64 runs and percent-encoded text that could hide injection payloads"""
+    decoded = []
+    
+    for match in _BASE64_RUN.finditer(normalized):
+        try:
+            decoded.append(base64.b64decode(match.group(), validate=True).decode("utf-8"))
+        except (binascii.Error, UnicodeDecodeError):
+            continue
+    
+    if _PERCENT_ESCAPE.search(normalized):
+        decoded.append(unquote(normalized))
+    
+    return [normalize_user_input(text) for text in decoded]
+
+def detect_prompt_injection(normalized_input: str) -> Tuple[bool, List[str]]:
     """
     Detect potential prompt injection attempts
     
+    Args:
+        normalized_input: User input already passed through normalize_user_input
+    
     Returns:
         Tuple of (is_suspicious, list_of_detected_patterns)
     """
-    suspicious_patterns = [
-        # Role override attempts
-        r"(?i)ignore\s+(?:all\s+)?(?:previous\s+)?instructions",
-        r"(?i)forget\s+(?:all\s+)?(?:previous\s+)?instructions", 
-        r"(?i)you\s+are\s+now\s+(?:a\s+)?(?:different\s+)?(?:ai|assistant|bot)",
-        r"(?i)new\s+instructions?",
-        r"(?i)override\s+(?:previous\s+)?(?:system\s+)?(?:instructions?|prompts?)",
-        
-        # System prompt manipulation
-        r"(?i)end\s+(?:of\s+)?(?:system\s+)?(?:instructions?|prompts?)",
-        r"(?i)system\s+(?:prompt|message)\s+(?:ends?|over)",
-        r"(?i)---+\s*end",
-        r"(?i)stop\s+being\s+(?:an?\s+)?(?:ai|assistant|bot)",
-        
-        # Tool bypass attempts
-        r"(?i)don'?t\s+use\s+(?:any\s+)?tools?",
-        r"(?i)never\s+use\s+(?:the\s+)?(?:currency|tool|function)",
-        r"(?i)without\s+using\s+(?:any\s+)?tools?",
-        r"(?i)make\s+up\s+(?:random\s+)?(?:numbers?|data|rates?)",
-        r"(?i)just\s+(?:say|tell|respond)",
-        
-        # Prompt structure manipulation
-        r"(?i)human\s*:|assistant\s*:|user\s*:|system\s*:",
-        r"<\|.*?\|>",  # Special tokens
-        r"\[(?:system|user|assistant)\]",
-        
-        # Direct instruction override
-        r"(?i)instead\s+of\s+using\s+tools?",
-        r"(?i)respond\s+with\s+['\"].*['\"]",
-        r"(?i)say\s+exactly\s+['\"].*['\"]",
-        r"(?i)pretend\s+(?:to\s+be|you\s+are)",
-    ]
+    corpus = [normalized_input] + _decode_obfuscated(normalized_input)
+    normalized = " ".join(corpus).casefold()
     
     detected_patterns = []
     
-    for pattern in suspicious_patterns:
-        if re.search(pattern, user_input):
+    for _, label in _AUTOMATON.iter(normalized):
+        if label not in detected_patterns:
+            detected_patterns.append(label)
+            if len(detected_patterns) >= INJECTION_BLOCK_THRESHOLD:
+                return True, detected_patterns
+    
+    for pattern, compiled in _COMPILED_PATTERNS:
+        try:
+            matched = compiled.search(normalized, timeout=REGEX_TIMEOUT_SECONDS)
+        except TimeoutError:
+            # Fail closed: input that stalls the regex engine is treated as an attack
+            detected_patterns.extend([pattern, "regex timeout"])
+            return True, detected_patterns
+        if matched:
             detected_patterns.append(pattern)
+            if len(detected_patterns) >= INJECTION_BLOCK_THRESHOLD:
+                break
     
     is_suspicious = len(detected_patterns) > 0
     return is_suspicious, detected_patterns
 
+# All sanitization rules fused into one alternation so the input is scanned once.
+# Special tokens absorb surrounding whitespace so removing them never leaves double spaces.
+_SPECIAL_TOKEN = r"<\|.*?\|>|\[(?:system|user|assistant)\]"
+_SPECIAL_TOKEN_PATTERN = re.compile(_SPECIAL_TOKEN)
+_SANITIZE_PATTERN = re.compile(
+    r"(?P<dash>-{3,})"
+    r"|(?P<role>(?P<role_name>(?i:human|assistant|user|system))\s*:)"
+    rf"|(?P<token>\s*(?:(?:{_SPECIAL_TOKEN})\s*)+)"
+    r"|(?P<ws>\s+)"
+)
+
+def _sanitize_once(text: str) -> Tuple[str, bool]:
+    """Apply every sanitization rule in a single scan; also report whether special tokens were removed"""
+    tokens_removed = False
+    
+    def replace(match: re.Match) -> str:
+        nonlocal tokens_removed
+        kind = match.lastgroup
+        if kind == "dash":
+            # Remove potential prompt delimiters
+            return "---"
+        if kind == "role":
+            # Escape role indicators to prevent confusion
+            return f"{match.group('role_name')} :"
+        if kind == "token":
+            # Remove special tokens, keeping a single space if whitespace surrounded them
+            tokens_removed = True
+            return " " if _SPECIAL_TOKEN_PATTERN.sub("", match.group()) else ""
+        # Remove excessive whitespace
+        return " "
+    
+    return _SANITIZE_PATTERN.sub(replace, text), tokens_removed
+
 def sanitize_user_input(user_input: str) -> str:
     """
     Sanitize user input by removing/escaping potentially dangerous content
     """
-    # Remove potential prompt delimiters
-    sanitized = re.sub(r"---+", "---", user_input)
-    
-    # Escape role indicators to prevent confusion
-    sanitized = re.sub(r"(?i)(human|assistant|user|system)\s*:", r"\1 :", sanitized)
-    
-    # Remove special tokens
-    sanitized = re.sub(r"<\|.*?\|>", "", sanitized)
-    sanitized = re.sub(r"\[(?:system|user|assistant)\]", "", sanitized)
+    sanitized, tokens_removed = _sanitize_once(user_input)
     
-    # Remove excessive whitespace
-    sanitized = re.sub(r"\s+", " ", sanitized)
+    # Removing a nested token can splice new tokens or role markers together
+    # (e.g. "[us<|x|>er]"), so rescan until a pass removes nothing
+    while tokens_removed:
+        sanitized, tokens_removed = _sanitize_once(sanitized)
     
     # Limit length to prevent overwhelming the context
     if len(sanitized) > 1000:
@@ -156,26 +305,51 @@ def validate_user_input(user_input: str) -> Tuple[bool, str, List[str]]:
     Returns:
         Tuple of (is_safe, sanitized_input, warnings)
     """
+    normalized_input = normalize_user_input(user_input)
+    
     # Detect injection attempts
-    is_suspicious, detected_patterns = detect_prompt_injection(user_input)
+    is_suspicious, detected_patterns = detect_prompt_injection(normalized_input)
     
     warnings = []
     if is_suspicious:
         warnings.append("Potential prompt injection detected")
         # Log detected patterns for monitoring
-        print(f"⚠️ Injection detected in: {user_input[:100]}...")
-        print(f"   Patterns: {detected_patterns}")
+        logger.warning("⚠️ Injection detected in: %s... Patterns: %s", user_input[:100], detected_patterns)
     
     # Sanitize input
-    sanitized_input = sanitize_user_input(user_input)
+    sanitized_input = sanitize_user_input(normalized_input)
     
     # Determine if input is safe (allow some flexibility for legitimate questions)
-    is_safe = len(detected_patterns) < 2  # Allow single pattern matches for edge cases
+    is_safe = len(detected_patterns) < INJECTION_BLOCK_THRESHOLD  # Allow single pattern matches for edge cases
     
     return is_safe, sanitized_input, warnings
 
+# Words that indicate a currency question; first messages without any of them skip the LLM
+_CURRENCY_TOKENS = frozenset({
+    "usd", "eur", "gbp", "jpy", "chf", "cad", "aud", "pln", "czk", "uah",
+    "dollar", "dollars", "euro", "euros", "pound", "pounds", "yen", "franc", "francs", "zloty", "hryvnia",
+    "rate", "rates", "exchange", "currency", "currencies", "price", "cost",
+})
+# Ukrainian/Russian stems (matched as word prefixes to cover inflections) and currency symbols
+_CURRENCY_STEMS = re.compile(
+    r"\b(?:курс|долар|доллар|євро|евро|гривн|гривен|валют|фунт|злот|франк|обмін|обмен)|[$€£¥₴]"
+)
+_WORD = re.compile(r"\w+")
+
+BLOCKED_RESPONSE = "I can only help with currency exchange rates from the National Bank of Ukraine. Please ask about currency rates without trying to change my behavior."
+CLARIFICATION_RESPONSE = "I can help with NBU currency exchange rates — which currency are you interested in?"
+
+def mentions_currency(message: str) -> bool:
+    """Cheap keyword check used to decide whether a message needs the agent at all"""
+    lowered = message.lower()
+    return not _CURRENCY_TOKENS.isdisjoint(_WORD.findall(lowered)) or _CURRENCY_STEMS.search(lowered) is not None
+
+# Hard cap on raw chat input, checked before any normalization or regex scanning so
+# oversized payloads can't hold the event loop in the sanitizer's lazy patterns
+MAX_MESSAGE_CHARS = 2000
+
 class ChatMessage(BaseModel):
-    message: str
+    message: str = Field(..., max_length=MAX_MESSAGE_CHARS)
     session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
@@ -183,18 +357,33 @@ class ChatResponse(BaseModel):
     session_id: str
     tool_used: Optional[str] = None
 
-class NBUCurrencyRate(BaseModel):
+# msgspec structs decode NBU payloads straight from bytes, skipping per-field Pydantic validation
+class NBUCurrencyRate(msgspec.Struct):
     r030: int
     txt: str
     rate: float
     cc: str
     exchangedate: str
 
-class CurrencyRatesResponse(BaseModel):
+class CurrencyRatesResponse(msgspec.Struct):
     rates: List[NBUCurrencyRate]
     date: str
     source: str = "National Bank of Ukraine"
 
+# The msgspec structs above aren't Pydantic models, so publish their JSON Schema
+# to the OpenAPI docs by hand
+_RATES_SCHEMAS, _RATES_COMPONENTS = msgspec.json.schema_components(
+    (CurrencyRatesResponse,), ref_template="#/components/schemas/{name}"
+)
+_default_openapi = app.openapi
+
+def _openapi_with_msgspec_schemas() -> Dict[str, Any]:
+    schema = _default_openapi()
+    schema.setdefault("components", {}).setdefault("schemas", {}).update(_RATES_COMPONENTS)
+    return schema
+
+app.openapi = _openapi_with_msgspec_schemas
+
 @app.get("/")
 async def root():
     return {"message": "AI Agent Backend is running"}
@@ -204,7 +393,7 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
 @app.get("/debug")
-async def debug_info():
+def debug_info():
     """Debug endpoint to check environment variables (for development only)"""
     api_key = os.getenv("OPENAI_API_KEY")
     return {
@@ -225,7 +414,10 @@ async def test_tool(valcode: str = "USD"):
 
 # NBU API integration is now handled by services/nbu_api.py
 
-@app.get("/currency-rates", response_model=CurrencyRatesResponse)
+@app.get(
+    "/currency-rates",
+    responses={200: {"content": {"application/json": {"schema": _RATES_SCHEMAS[0]}}}}
+)
 async def get_currency_rates(valcode: Optional[str] = 'USD', date: Optional[str] = None):
     """
     Get currency exchange rates from National Bank of Ukraine
@@ -236,17 +428,17 @@ async def get_currency_rates(valcode: Optional[str] = 'USD', date: Optional[str]
     """
     try:
         # Use the NBU API service
-        data = await fetch_currency_rates(valcode, date)
+        raw = await fetch_currency_rates_raw(valcode, date)
         
-        # Convert to our response format
-        rates = [NBUCurrencyRate(**item) for item in data]
+        # Decode the raw body once, directly into our response format
+        rates = msgspec.json.decode(raw, type=List[NBUCurrencyRate])
         
         # Get date from first item or use today's date
         response_date = rates[0].exchangedate if rates else datetime.now().strftime("%d.%m.%Y")
         
-        return CurrencyRatesResponse(
-            rates=rates,
-            date=response_date
+        return Response(
+            content=msgspec.json.encode(CurrencyRatesResponse(rates=rates, date=response_date)),
+            media_type="application/json"
         )
     except NBUAPIError as e:
         raise HTTPException(status_code=503, detail=f"NBU API error: {str(e)}")
@@ -258,91 +450,181 @@ async def get_currency_rates(valcode: Optional[str] = 'USD', date: Optional[str]
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(chat_message: ChatMessage):
     """
-    Chat endpoint that uses LangChain agent to intelligently call tools with session history
+    Chat endpoint that uses the OpenAI tool-calling agent to intelligently call tools with session history
     """
     try:
-        print(f"📥 Received message: {chat_message.message}")  # Debug log
+        logger.debug("📥 Received message: %s", chat_message.message)
         
         # 🛡️ SECURITY: Validate and sanitize user input
         is_safe, sanitized_message, warnings = validate_user_input(chat_message.message)
         
         if not is_safe:
-            print(f"🚨 Blocking potentially dangerous input")
+            logger.warning("🚨 Blocking potentially dangerous input")
             return ChatResponse(
-                response="I can only help with currency exchange rates from the National Bank of Ukraine. Please ask about currency rates without trying to change my behavior.",
-                session_id=get_or_create_session(chat_message.session_id),
+                response=BLOCKED_RESPONSE,
+                session_id=await get_or_create_session(chat_message.session_id),
                 tool_used=None
             )
         
         if warnings:
-            print(f"⚠️ Warnings for user input: {warnings}")
+            logger.info("⚠️ Warnings for user input: %s", warnings)
         
         # Get or create session
-        session_id = get_or_create_session(chat_message.session_id)
-        print(f"🔗 Using session: {session_id}")  # Debug log
+        session_id = await get_or_create_session(chat_message.session_id)
+        logger.debug("🔗 Using session: %s", session_id)
         
         # Get chat history for this session
-        chat_history_raw = get_chat_history(session_id)
-        chat_history = format_history_for_langchain(chat_history_raw)
-        print(f"📚 Chat history length: {len(chat_history)} messages")  # Debug log
+        chat_history_raw = await get_chat_history(session_id)
+        chat_history = format_history_for_agent(chat_history_raw)
+        logger.debug("📚 Chat history length: %d messages", len(chat_history))
+        
+        # Skip the LLM round-trip for opening messages unrelated to currencies;
+        # follow-ups may rely on earlier turns, so they always go to the agent
+        if not chat_history_raw and not mentions_currency(sanitized_message):
+            await add_to_chat_history(session_id, chat_message.message, CLARIFICATION_RESPONSE)
+            return ChatResponse(response=CLARIFICATION_RESPONSE, session_id=session_id, tool_used=None)
         
         # Use Agent Service to process the SANITIZED message
         result = await agent_service.process_message(sanitized_message, chat_history)
         
-        print(f"🤖 Agent result: {result}")  # Debug log
+        logger.debug("🤖 Agent result: %s", result)
         
         ai_response = result["response"]
         tool_used = result["tool_used"]
         
         # Add ORIGINAL message to history (so user sees what they sent)
         # but agent processed the sanitized version
-        add_to_chat_history(session_id, chat_message.message, ai_response)
+        await add_to_chat_history(session_id, chat_message.message, ai_response)
         
-        print(f"📤 Final response: {ai_response}, Tool used: {tool_used}")  # Debug log
+        logger.debug("📤 Final response: %s, Tool used: %s", ai_response, tool_used)
         
         return ChatResponse(response=ai_response, session_id=session_id, tool_used=tool_used)
         
     except Exception as e:
-        print(f"❌ Error in chat endpoint: {str(e)}")  # Debug log
+        logger.exception("❌ Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing chat message: {str(e)}")
 
+def _sse(payload: Dict[str, Any]) -> str:
+    """Format a payload as a Server-Sent Events message"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def _single_reply_stream(response: str, session_id: str) -> StreamingResponse:
+    """Stream a canned reply using the same event format as the agent stream"""
+    async def event_stream():
+        yield _sse({"type": "token", "content": response})
+        yield _sse({"type": "done", "session_id": session_id, "tool_used": None})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/chat/stream")
+async def chat_with_agent_stream(chat_message: ChatMessage):
+    """
+    Streaming variant of /chat that sends the agent reply as Server-Sent Events
+    
+    Events are JSON objects: {"type": "token", "content": ...} while the reply is generated,
+    then {"type": "done", "session_id": ..., "tool_used": ...} once it is stored in history,
+    or {"type": "error", "detail": ...} if the agent fails.
+    """
+    logger.debug("📥 Received message (stream): %s", chat_message.message)
+    
+    # 🛡️ SECURITY: Validate and sanitize user input
+    is_safe, sanitized_message, warnings = validate_user_input(chat_message.message)
+    session_id = await get_or_create_session(chat_message.session_id)
+    
+    if not is_safe:
+        logger.warning("🚨 Blocking potentially dangerous input")
+        return _single_reply_stream(BLOCKED_RESPONSE, session_id)
+    
+    chat_history_raw = await get_chat_history(session_id)
+    
+    if not chat_history_raw and not mentions_currency(sanitized_message):
+        await add_to_chat_history(session_id, chat_message.message, CLARIFICATION_RESPONSE)
+        return _single_reply_stream(CLARIFICATION_RESPONSE, session_id)
+    
+    chat_history = format_history_for_agent(chat_history_raw)
+    
+    async def event_stream():
+        parts = []
+        tool_used = None
+        try:
+            async for event in agent_service.stream_message(sanitized_message, chat_history):
+                if event["type"] == "token":
+                    parts.append(event["content"])
+                    yield _sse(event)
+                elif event["type"] == "tool":
+                    tool_used = event["tool_used"]
+        except Exception as e:
+            logger.exception("❌ Error in chat stream: %s", e)
+            yield _sse({"type": "error", "detail": f"Error processing chat message: {str(e)}"})
+            return
+        
+        # Store the ORIGINAL message with the fully assembled reply
+        await add_to_chat_history(session_id, chat_message.message, "".join(parts))
+        yield _sse({"type": "done", "session_id": session_id, "tool_used": tool_used})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/chat/history/{session_id}")
 async def get_session_history(session_id: str):
     """Get chat history for a specific session"""
-    if session_id not in chat_sessions:
+    if not await _redis.exists(_marker_key(session_id)):
         raise HTTPException(status_code=404, detail="Session not found")
     
+    history = format_history_for_agent(await get_chat_history(session_id))
     return {
         "session_id": session_id,
-        "history": chat_sessions[session_id],
-        "message_count": len(chat_sessions[session_id])
+        "history": history,
+        "message_count": len(history)
     }
 
 @app.delete("/chat/history/{session_id}")
 async def clear_session_history(session_id: str):
     """Clear chat history for a specific session"""
-    if session_id in chat_sessions:
-        del chat_sessions[session_id]
+    if await _redis.delete(_marker_key(session_id), _history_key(session_id)):
         return {"message": f"Session {session_id} cleared successfully"}
     else:
         raise HTTPException(status_code=404, detail="Session not found")
 
+def _build_sessions_snapshot(sessions: List[Tuple[str, int, Optional[str]]]) -> List[Dict[str, Any]]:
+    """Summarize sessions for the listing endpoint"""
+    return [
+        {
+            "session_id": session_id,
+            "message_count": message_count,
+            "last_message": json.loads(last_entry)[1][:100] + "..." if last_entry else "No messages"
+        }
+        for session_id, message_count, last_entry in sessions
+    ]
+
 @app.get("/chat/sessions")
 async def list_active_sessions():
     """List all active chat sessions"""
-    sessions_info = []
-    for session_id, history in chat_sessions.items():
-        sessions_info.append({
-            "session_id": session_id,
-            "message_count": len(history),
-            "last_message": history[-1]["content"][:100] + "..." if history else "No messages"
-        })
+    prefix = _marker_key("")
+    session_ids = [key[len(prefix):] async for key in _redis.scan_iter(match=f"{prefix}*")]
+    
+    async with _redis.pipeline(transaction=False) as pipe:
+        for session_id in session_ids:
+            pipe.llen(_history_key(session_id))
+            pipe.lindex(_history_key(session_id), -1)
+        results = await pipe.execute()
+    
+    sessions = list(zip(session_ids, results[0::2], results[1::2]))
+    sessions_info = await asyncio.to_thread(_build_sessions_snapshot, sessions)
     
     return {
-        "active_sessions": len(chat_sessions),
+        "active_sessions": len(sessions_info),
         "sessions": sessions_info
     }
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop is not available on Windows, fall back to the default asyncio loop there
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "2"))
+    )
\ No newline at end of file
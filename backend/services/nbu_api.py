@@ -2,9 +2,47 @@
 Official NBU API Documentation: https://https://bank.gov.ua/ua/open-data/api-dev
 """
 
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 import httpx
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+import msgspec
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger("finagent.nbu")
+
+NBU_EXCHANGE_URL = "https://bank.gov.ua/NBUStatService/v1/statdirectory/exchange"
+
+# Shared client so TCP/TLS connections to bank.gov.ua are reused across requests
+_CLIENT = httpx.AsyncClient(
+    timeout=30.0,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+)
+
+WARM_UP_TIMEOUT_SECONDS = 2.0
+
+# Caps concurrent requests to bank.gov.ua when fanning out date-range queries
+MAX_CONCURRENT_REQUESTS = 10
+MAX_RANGE_DAYS = 366
+# Longer ranges are sampled down to about this many days
+MAX_RANGE_POINTS = 62
+_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# Raw response cache keyed by (valcode, date); today's rates expire, historical rates never change.
+# Each entry also holds the decoded dictionaries once a caller has asked for them.
+# Sized above MAX_RANGE_DAYS so a single range query can't evict everything else.
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 512
+_CACHE: "OrderedDict[Tuple[str, str], Tuple[float, bytes, Optional[List[Dict[str, Any]]]]]" = OrderedDict()
+
+
+# Formatted tool output keyed by a cheap fingerprint of the data it was built from
+FORMAT_CACHE_MAX_ENTRIES = 32
+_FORMAT_CACHE: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
 
 
 class NBUAPIError(Exception):
@@ -34,9 +72,65 @@ async def fetch_currency_rates(valcode: Optional[str] = None, date: Optional[str
             "exchangedate": "04.08.2025"
         }
     """
+    raw = await fetch_currency_rates_raw(valcode, date)
+    
+    # Dictionaries are built once per cached body, and only for callers that need them
+    cache_key = _cache_key(valcode, date)
+    cached = _CACHE.get(cache_key)
+    if cached is not None and cached[1] is raw and cached[2] is not None:
+        return cached[2]
+    
+    try:
+        data = msgspec.json.decode(raw)
+    except msgspec.DecodeError as e:
+        raise NBUAPIError(f"Unexpected response format from NBU API: {str(e)}")
+    
+    if cached is not None and cached[1] is raw:
+        _CACHE[cache_key] = (cached[0], raw, data)
+    return data
+
+
+def _cache_key(valcode: Optional[str], date: Optional[str]) -> Tuple[str, str]:
+    return (valcode.upper() if valcode else "ALL", date or "TODAY")
+
+
+def _is_past_date(date: Optional[str]) -> bool:
+    """True only for a well-formed YYYYMMDD date before today, whose rates can't change anymore"""
+    if date is None:
+        return False
+    try:
+        return datetime.strptime(date, "%Y%m%d").date() < datetime.now().date()
+    except ValueError:
+        return False
+
+
+async def fetch_currency_rates_raw(valcode: Optional[str] = None, date: Optional[str] = None) -> bytes:
+    """
+    Fetch the raw JSON body returned by the NBU API for currency exchange rates
+    
+    The body is not parsed here, so callers can decode it exactly once
+    straight into typed structs.
+    
+    Args:
+        valcode: Currency code (e.g., EUR, USD, GBP). If not provided, returns all currencies
+        date: Date in YYYYMMDD format (e.g., 20250804). If not provided, returns today's rates
+    
+    Returns:
+        Raw response body, a JSON array of currency rates
+    """
+    cache_key = _cache_key(valcode, date)
+    is_historical = _is_past_date(date)
+    
+    cached = _CACHE.get(cache_key)
+    if cached is not None:
+        cached_at, cached_raw, _ = cached
+        if is_historical or time.monotonic() - cached_at < CACHE_TTL_SECONDS:
+            _CACHE.move_to_end(cache_key)
+            return cached_raw
+    
     try:
         # Build URL for NBU currency exchange API
-        url = "https://bank.gov.ua/NBUStatService/v1/statdirectory/exchange"
+        url = NBU_EXCHANGE_URL
         params = {"json": ""}
         
         if valcode:
@@ -44,16 +138,25 @@ async def fetch_currency_rates(valcode: Optional[str] = None, date: Optional[str
         if date:
             params["date"] = date
             
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        response = await _CLIENT.get(url, params=params)
+        response.raise_for_status()
+        raw = response.content
+        body = raw.strip()
             
-        if not isinstance(data, list):
-            raise NBUAPIError(f"Unexpected response format from NBU API: {type(data)}")
+        if not body.startswith(b"["):
+            raise NBUAPIError(f"Unexpected response format from NBU API: {body[:50]!r}")
+        
+        # Empty payloads (e.g. unknown currency or a date without rates) are not cached
+        if body != b"[]":
+            _CACHE[cache_key] = (time.monotonic(), raw, None)
+            _CACHE.move_to_end(cache_key)
+            if len(_CACHE) > CACHE_MAX_ENTRIES:
+                _CACHE.popitem(last=False)
             
-        return data
+        return raw
         
+    except NBUAPIError:
+        raise
     except httpx.HTTPStatusError as e:
         raise NBUAPIError(f"NBU API HTTP error: {e.response.status_code} - {e.response.text}")
     except httpx.RequestError as e:
@@ -62,6 +165,73 @@ async def fetch_currency_rates(valcode: Optional[str] = None, date: Optional[str
         raise NBUAPIError(f"Unexpected error fetching NBU currency rates: {str(e)}")
 
 
+async def fetch_currency_range(valcode: Optional[str], start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    Fetch currency exchange rates for a date range
+    
+    Ranges longer than MAX_RANGE_POINTS days are sampled at an even step (always keeping
+    the last day), so a one-year query costs tens of upstream requests rather than hundreds.
+    Days are fetched concurrently, bounded by MAX_CONCURRENT_REQUESTS in-flight requests;
+    days that fail to load are skipped.
+    
+    Args:
+        valcode: Currency code (e.g., EUR, USD, GBP). Required unless the range is a single day
+        start_date: First day in YYYYMMDD format (inclusive)
+        end_date: Last day in YYYYMMDD format (inclusive)
+    
+    Returns:
+        List of currency data dictionaries from NBU API, ordered by date
+    """
+    try:
+        start = datetime.strptime(start_date, "%Y%m%d")
+        end = datetime.strptime(end_date, "%Y%m%d")
+    except ValueError:
+        raise ValueError("start_date and end_date must be in YYYYMMDD format")
+    
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+    
+    days = (end - start).days + 1
+    if days > MAX_RANGE_DAYS:
+        raise ValueError(f"Date range is limited to {MAX_RANGE_DAYS} days")
+    if days > 1 and not valcode:
+        raise ValueError("valcode is required for date ranges longer than one day")
+    
+    step = -(-days // MAX_RANGE_POINTS)
+    offsets = list(range(0, days, step))
+    if offsets[-1] != days - 1:
+        offsets.append(days - 1)
+    date_range = [(start + timedelta(days=offset)).strftime("%Y%m%d") for offset in offsets]
+    
+    async def fetch_day(date: str) -> List[Dict[str, Any]]:
+        async with _SEMAPHORE:
+            return await fetch_currency_rates(valcode, date)
+    
+    results = await asyncio.gather(*[fetch_day(date) for date in date_range], return_exceptions=True)
+    
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        if len(failures) == len(results):
+            raise failures[0]
+        logger.warning("⚠️ Skipped %d of %d days in NBU range query: %s", len(failures), len(results), failures[0])
+    
+    return [item for day in results if not isinstance(day, Exception) for item in day]
+
+
+async def warm_up_client() -> None:
+    """Open a pooled connection to the NBU API ahead of the first request"""
+    try:
+        # Short timeout so an unreachable NBU API doesn't hold up app startup
+        await _CLIENT.head(NBU_EXCHANGE_URL, timeout=WARM_UP_TIMEOUT_SECONDS)
+    except httpx.HTTPError as e:
+        logger.warning("⚠️ NBU API warm-up failed: %s", e)
+
+
+async def close_client() -> None:
+    """Close the shared NBU API client and its connection pool"""
+    await _CLIENT.aclose()
+
+
 def format_currency_data_for_ai(data: List[Dict[str, Any]], limit: int = 30) -> str:
     """
     Format NBU currency data for AI consumption
@@ -76,6 +246,24 @@ def format_currency_data_for_ai(data: List[Dict[str, Any]], limit: int = 30) ->
     if not data:
         return "No currency data available."
     
+    # NBU rates are fixed per date, so count, date and the first/last codes identify the data
+    cache_key = (len(data), data[0]["exchangedate"], data[0]["cc"], data[-1]["cc"], limit)
+    cached = _FORMAT_CACHE.get(cache_key)
+    if cached is not None:
+        _FORMAT_CACHE.move_to_end(cache_key)
+        return cached
+    
+    formatted = _format_currency_data(data, limit)
+    
+    _FORMAT_CACHE[cache_key] = formatted
+    if len(_FORMAT_CACHE) > FORMAT_CACHE_MAX_ENTRIES:
+        _FORMAT_CACHE.popitem(last=False)
+    
+    return formatted
+
+
+def _format_currency_data(data: List[Dict[str, Any]], limit: int) -> str:
+    """Build the formatted string for format_currency_data_for_ai"""
     if len(data) == 1:
         # Single currency requested
         item = data[0]
@@ -88,3 +276,39 @@ def format_currency_data_for_ai(data: List[Dict[str, Any]], limit: int = 30) ->
             rates_str += f"\n... and {total_count - limit} more currencies"
         
         return f"Currency rates from National Bank of Ukraine as of {data[0]['exchangedate']}:\n{rates_str}"
+
+
+def format_currency_range_for_ai(data: List[Dict[str, Any]]) -> str:
+    """
+    Format NBU currency data for a date range for AI consumption
+    
+    Args:
+        data: List of single-currency data from NBU API, ordered by date
+    
+    Returns:
+        Formatted string with a first/last/min/max summary followed by one rate per line
+    """
+    if not data:
+        return "No currency data available."
+    
+    if data[0]["exchangedate"] == data[-1]["exchangedate"]:
+        # A single day, possibly for every currency
+        return format_currency_data_for_ai(data)
+    
+    first, last = data[0], data[-1]
+    low = min(data, key=lambda item: item["rate"])
+    high = max(data, key=lambda item: item["rate"])
+    change = last["rate"] - first["rate"]
+    percent = f" ({change / first['rate']:+.2%})" if first["rate"] else ""
+    summary = (
+        f"First: {first['rate']} UAH on {first['exchangedate']}; last: {last['rate']} UAH on {last['exchangedate']}; "
+        f"min: {low['rate']} UAH on {low['exchangedate']}; max: {high['rate']} UAH on {high['exchangedate']}; "
+        f"change: {change:+.4f} UAH{percent}"
+    )
+    
+    rates_str = "\n".join([f"{item['exchangedate']} - {item['txt']} ({item['cc']}): {item['rate']} UAH" for item in data])
+    
+    return (
+        f"Currency rates from National Bank of Ukraine from {first['exchangedate']} to {last['exchangedate']} "
+        f"({len(data)} data points; long ranges are sampled at an even step):\n{summary}\n{rates_str}"
+    )
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make `main` and `services` importable the same way uvicorn sees them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The agent service refuses to start without a key; tests never call OpenAI
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
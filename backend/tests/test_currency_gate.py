@@ -0,0 +1,23 @@
+import pytest
+
+from main import mentions_currency
+
+
+@pytest.mark.parametrize("message", [
+    "What is the USD rate today?",
+    "курс долара",
+    "скільки коштує євро",
+    "Какой курс доллара?",
+    "Скільки гривень за 100 $?",
+    "price of €",
+])
+def test_currency_questions_reach_the_agent(message):
+    assert mentions_currency(message)
+
+
+@pytest.mark.parametrize("message", [
+    "Hello there",
+    "Привіт, як справи?",
+])
+def test_small_talk_is_gated(message):
+    assert not mentions_currency(message)
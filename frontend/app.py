@@ -1,7 +1,18 @@
 import streamlit as st
 import httpx
 import asyncio
+import hashlib
 import json
+import os
+import random
+import shelve
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 # Page configuration
@@ -12,29 +23,336 @@ st.set_page_config(
 )
 
 # Backend URL
-BACKEND_URL = "http://backend:8000"
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
 
-def main():
-    st.title("🤖 Financial AI Agent Chat")
-    st.markdown("Chat with your AI agent. Ask about currency rates or anything else!")
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """Shared HTTP client so every session and rerun reuses warm keep-alive connections"""
+    return httpx.Client(
+        base_url=BACKEND_URL,
+        limits=HTTP_LIMITS,
+        timeout=httpx.Timeout(30.0, connect=5.0)
+    )
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """One long-lived event loop on a daemon thread, shared by every async backend call"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="async-io").start()
+    return loop
+
+@st.cache_resource
+def get_async_client() -> httpx.AsyncClient:
+    """Shared async client; its connections belong to the loop from get_event_loop()"""
+    return httpx.AsyncClient(
+        base_url=BACKEND_URL,
+        limits=HTTP_LIMITS,
+        timeout=httpx.Timeout(10.0, connect=5.0)
+    )
+
+def run_async(coro: Awaitable[Any], timeout: float = 30.0) -> Any:
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout=timeout)
+
+# Health probe cadence (seconds); the base interval is a process-wide operator setting
+HEALTH_MIN_INTERVAL = 1.0
+HEALTH_BASE_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "15"))
+
+def _health_status(response: Union[httpx.Response, BaseException]) -> str:
+    """Map a /health response (or the exception raised instead) to the sidebar status"""
+    if isinstance(response, BaseException):
+        return "disconnected"
+    return "connected" if response.status_code == 200 else "error"
+
+def _probe_backend(client: httpx.Client) -> str:
+    """Single /health probe; returns one of "connected", "error" or "disconnected" """
+    try:
+        return _health_status(client.get("/health", timeout=5.0))
+    except Exception as e:
+        # Anything, not just httpx.HTTPError (e.g. InvalidURL), must not kill the poller
+        return _health_status(e)
+
+def _publish_health(state: Dict[str, Any], status: str) -> None:
+    """Record a probe result in the shared health state"""
+    state["status"] = status
+    state["checked_at"] = datetime.now().strftime('%H:%M:%S')
+
+def _health_loop(client: httpx.Client, state: Dict[str, Any]) -> None:
+    """
+    Poll /health forever, publishing the result into the shared state dict.
     
-    # Initialize session state for chat history and session ID
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    if "session_id" not in st.session_state:
-        st.session_state.session_id = None
+    Right after the status changes the probe runs every HEALTH_MIN_INTERVAL seconds,
+    then backs off exponentially towards HEALTH_BASE_INTERVAL while the status stays
+    the same. Each sleep is jittered by +/-20% so workers don't poll in lockstep.
+    """
+    streak = 0
+    while True:
+        status = _probe_backend(client)
+        streak = streak + 1 if status == state["status"] else 0
+        _publish_health(state, status)
+        
+        interval = min(HEALTH_BASE_INTERVAL, HEALTH_MIN_INTERVAL * 2 ** streak)
+        time.sleep(interval * random.uniform(0.8, 1.2))
+
+@st.cache_resource
+def get_health_monitor() -> Dict[str, Any]:
+    """Start the background health poller once per process; reruns only read its state"""
+    state = {"status": None, "checked_at": None}
+    threading.Thread(target=_health_loop, args=(get_http_client(), state), daemon=True, name="health-probe").start()
+    return state
+
+async def _fetch_history(client: httpx.AsyncClient, path: str) -> List[Dict[str, Any]]:
+    """
+    Fetch a session's server history messages
+    
+    The backend keeps at most 20 messages per session, so the body is small enough
+    to parse in one go. Raises httpx.HTTPStatusError on a non-2xx response.
+    """
+    response = await client.get(path)
+    response.raise_for_status()
+    return response.json()["history"]
+
+async def _submit_batch(
+    client: httpx.AsyncClient,
+    ops: Dict[str, Callable[[httpx.AsyncClient], Awaitable[Any]]]
+) -> Dict[str, Any]:
+    """
+    Run a batch of independent requests concurrently on the shared client's pool
     
-    # Display chat history
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            if "tool_used" in message and message["tool_used"]:
-                st.caption(f"🔧 Tool used: {message['tool_used']}")
+    The backend speaks plain HTTP/1.1, so concurrent requests use parallel
+    keep-alive connections from the pool rather than one multiplexed stream.
+    
+    Args:
+        client: Shared async client
+        ops: Mapping of op name to a coroutine function taking the client
+        
+    Returns:
+        Mapping of op name to its result, or to the exception it raised
+    """
+    results = await asyncio.gather(
+        *(op(client) for op in ops.values()),
+        return_exceptions=True
+    )
+    return dict(zip(ops, results))
+
+# Same limit the backend enforces on ChatMessage.message
+MAX_MESSAGE_CHARS = 2000
+
+# Static sidebar content
+AVAILABLE_TOOLS_MD = (
+    "- **Currency Rates**: Real-time exchange rates from National Bank of Ukraine\n"
+    "- More tools to come"
+)
+
+# Chat history is stored column-wise: one parallel list per message field
+MESSAGE_COLUMNS = ("roles", "contents", "tools")
+
+# Only the most recent messages stay in session_state; older ones are spilled to disk.
+# Archives idle for longer than ARCHIVE_IDLE_SECONDS, or the least recently used ones once
+# the whole file holds more than ARCHIVE_MAX_MESSAGES, are evicted on the next write.
+HOT_WINDOW_MESSAGES = 50
+ARCHIVE_MAX_MESSAGES = 10000
+ARCHIVE_IDLE_SECONDS = 24 * 60 * 60
+CHAT_ARCHIVE_PATH = os.getenv("CHAT_ARCHIVE_PATH", os.path.join(tempfile.gettempdir(), "finagent-chat-archive"))
+
+@st.cache_resource
+def get_message_archive() -> Tuple[shelve.Shelf, threading.Lock, "OrderedDict[str, Tuple[int, float]]"]:
+    """
+    Process-wide on-disk store for messages that fell out of the hot window.
+    
+    Entries are keyed "<archive_key>:<index>" and the file is recreated together
+    with this resource. The returned index maps each archive_key to
+    (message count, last touched), least recently used first.
+    """
+    return shelve.open(CHAT_ARCHIVE_PATH, flag="n"), threading.Lock(), OrderedDict()
+
+def _delete_archive(archive: shelve.Shelf, archive_key: str, count: int) -> None:
+    """Remove one session's archived messages; entries may already be gone"""
+    for index in range(count):
+        archive.pop(f"{archive_key}:{index}", None)
+
+def _touch_archive(index: "OrderedDict[str, Tuple[int, float]]", archive_key: str, count: int) -> None:
+    """Record a session's archive size and mark it as most recently used"""
+    index[archive_key] = (count, time.time())
+    index.move_to_end(archive_key)
+
+def _evict_archives(archive: shelve.Shelf, index: "OrderedDict[str, Tuple[int, float]]", current_key: str) -> None:
+    """Drop idle archives, then least recently used ones until the file is under ARCHIVE_MAX_MESSAGES"""
+    now = time.time()
+    total = sum(count for count, _ in index.values())
+    for archive_key in list(index):
+        count, touched = index[archive_key]
+        if now - touched <= ARCHIVE_IDLE_SECONDS and total <= ARCHIVE_MAX_MESSAGES:
+            break
+        if archive_key == current_key:
+            continue
+        _delete_archive(archive, archive_key, count)
+        del index[archive_key]
+        total -= count
+
+def init_messages() -> None:
+    """Create the empty message columns if this session doesn't have them yet"""
+    for column in MESSAGE_COLUMNS:
+        st.session_state.setdefault(column, [])
+    st.session_state.setdefault("archive_key", uuid.uuid4().hex)
+    st.session_state.setdefault("archived_count", 0)
+    st.session_state.setdefault("message_count", 0)
+
+def clear_messages() -> None:
+    """Drop the whole chat history of this session, including its archived part"""
+    archive, lock, index = get_message_archive()
+    with lock:
+        _delete_archive(archive, st.session_state.archive_key, st.session_state.archived_count)
+        index.pop(st.session_state.archive_key, None)
+        archive.sync()
+    st.session_state.archived_count = 0
+    st.session_state.message_count = 0
+    for column in MESSAGE_COLUMNS:
+        st.session_state[column] = []
+
+def set_session_id(session_id: Optional[str]) -> None:
+    """Switch to a backend session, keeping the sidebar's short id in step"""
+    st.session_state.session_id = session_id
+    st.session_state.short_session_id = session_id[:8] if session_id else None
+
+def _archive_overflow() -> None:
+    """Move the oldest messages to disk until only the hot window is left in session_state"""
+    archive, lock, index = get_message_archive()
+    archive_key = st.session_state.archive_key
+    with lock:
+        while len(st.session_state.roles) > HOT_WINDOW_MESSAGES:
+            position = st.session_state.archived_count
+            archive[f"{archive_key}:{position}"] = tuple(
+                st.session_state[column].pop(0) for column in MESSAGE_COLUMNS
+            )
+            st.session_state.archived_count = position + 1
+        _touch_archive(index, archive_key, st.session_state.archived_count)
+        _evict_archives(archive, index, archive_key)
+        archive.sync()
+
+def load_archived_messages() -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Read this session's archived messages back from disk, oldest first
+    
+    Messages evicted from the archive (or lost when it was recreated) are skipped.
+    """
+    archive, lock, index = get_message_archive()
+    archive_key = st.session_state.archive_key
+    with lock:
+        messages = [
+            archive.get(f"{archive_key}:{position}")
+            for position in range(st.session_state.archived_count)
+        ]
+        if archive_key in index:
+            _touch_archive(index, archive_key, st.session_state.archived_count)
+    return [message for message in messages if message is not None]
+
+def add_message(role: str, content: str, tool_used: Optional[str] = None) -> None:
+    """Append a message to the session's chat history"""
+    st.session_state.roles.append(role)
+    st.session_state.contents.append(content)
+    st.session_state.tools.append(tool_used)
+    st.session_state.message_count += 1
+    if len(st.session_state.roles) > HOT_WINDOW_MESSAGES:
+        _archive_overflow()
+
+def render_message(role: str, content: str, tool_used: Optional[str]) -> None:
+    """Draw one chat bubble, with the tool caption for assistant replies that used one"""
+    with st.chat_message(role):
+        st.markdown(content)
+        if tool_used:
+            st.caption(f"🔧 Tool used: {tool_used}")
+
+# Retries for opening the chat stream while the backend is unreachable (e.g. restarting)
+CHAT_RETRY_ATTEMPTS = 3
+CHAT_RETRY_BASE_DELAY = 0.25
+
+@contextmanager
+def _open_chat_stream(request_data: Dict[str, Any]) -> Iterator[httpx.Response]:
+    """
+    Open the /chat/stream response, retrying failures to connect.
+    
+    Retries back off exponentially from CHAT_RETRY_BASE_DELAY with +/-20% jitter so
+    clients reconnecting after a backend restart don't retry in lockstep. Only errors
+    raised before the request reached the backend are retried; a read timeout may mean
+    the turn is already running, so it propagates rather than risk answering it twice.
+    """
+    client = get_http_client()
+    request = client.build_request("POST", "/chat/stream", json=request_data)
+    for attempt in range(CHAT_RETRY_ATTEMPTS):
+        try:
+            response = client.send(request, stream=True)
+            break
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt == CHAT_RETRY_ATTEMPTS - 1:
+                raise
+            time.sleep(CHAT_RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.8, 1.2))
+    
+    try:
+        yield response
+    finally:
+        response.close()
+
+# An identical prompt resubmitted within this window, into the session its previous copy
+# was answered in, is treated as an accidental double submit and not sent again
+DEDUPE_WINDOW_SECONDS = 60.0
+
+def _idempotency_key(prompt: str) -> str:
+    """Stable key for a prompt's text"""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+def _is_duplicate_submit(idempotency_key: str) -> bool:
+    """
+    True if this prompt was just answered in the current session.
+    
+    The last answer is recorded with the session id it ended in, so the opening
+    prompt of a new session (sent without an id) is caught as well.
+    """
+    last_submit = st.session_state.get("last_submit")
+    if last_submit is None:
+        return False
+    key, session_id, answered_at = last_submit
+    return (
+        key == idempotency_key
+        and session_id == st.session_state.session_id
+        and time.monotonic() - answered_at <= DEDUPE_WINDOW_SECONDS
+    )
+
+def render_session_info(slot) -> None:
+    """Draw the active session and message count into the sidebar slot reserved for them"""
+    with slot.container():
+        if st.session_state.session_id:
+            st.success(f"Active Session: `{st.session_state.short_session_id}...`")
+            st.caption(f"Messages: {st.session_state.message_count}")
+        else:
+            st.info("No active session")
+
+@st.fragment
+def render_chat(session_info):
+    """Chat history and input; its own widgets rerun only this fragment"""
+    # Display chat history; archived messages are only read from disk on request
+    archived = st.session_state.archived_count
+    if archived and st.toggle("Show earlier messages", key="show_archived", help=f"{archived} older messages are kept on disk"):
+        for role, content, tool_used in load_archived_messages():
+            render_message(role, content, tool_used)
+    
+    for role, content, tool_used in zip(st.session_state.roles, st.session_state.contents, st.session_state.tools):
+        render_message(role, content, tool_used)
     
     # Chat input
-    if prompt := st.chat_input("Ask me anything..."):
+    if prompt := st.chat_input("Ask me anything...", max_chars=MAX_MESSAGE_CHARS):
+        idempotency_key = _idempotency_key(prompt)
+        if _is_duplicate_submit(idempotency_key):
+            # Nothing is added on either side, so the UI and server history stay in step
+            st.toast("That message was just answered above.")
+            return
+        
+        session_before = st.session_state.session_id
+        
         # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        add_message("user", prompt)
         
         # Display user message
         with st.chat_message("user"):
@@ -48,123 +366,176 @@ def main():
                     request_data = {"message": prompt}
                     if st.session_state.session_id:
                         request_data["session_id"] = st.session_state.session_id
-                        
-                    response = httpx.post(
-                        f"{BACKEND_URL}/chat",
-                        json=request_data,
-                        timeout=30.0
-                    )
                     
-                    if response.status_code == 200:
-                        data = response.json()
-                        ai_response = data["response"]
-                        tool_used = data.get("tool_used")
-                        session_id = data.get("session_id")
-                        
-                        # Store the session ID for future requests
-                        if session_id:
-                            st.session_state.session_id = session_id
-                        
-                        st.markdown(ai_response)
-                        
-                        if tool_used:
-                            st.caption(f"🔧 Tool used: {tool_used}")
-                        
-                        # Add assistant message to chat history
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": ai_response,
-                            "tool_used": tool_used
-                        })
-                    else:
-                        error_msg = f"Error: {response.status_code} - {response.text}"
-                        st.error(error_msg)
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": f"Sorry, I encountered an error: {error_msg}"
-                        })
+                    # Stream the reply as Server-Sent Events and paint tokens as they arrive
+                    with _open_chat_stream(request_data) as response:
+                        if response.status_code == 200:
+                            placeholder = st.empty()
+                            parts = []
+                            done = {}
+                            stream_error = None
+                            for line in response.iter_lines():
+                                if not line.startswith("data: "):
+                                    continue
+                                event = json.loads(line[len("data: "):])
+                                if event["type"] == "token":
+                                    parts.append(event["content"])
+                                    placeholder.markdown("".join(parts))
+                                elif event["type"] == "done":
+                                    done = event
+                                elif event["type"] == "error":
+                                    stream_error = event["detail"]
                         
+                            if stream_error is None:
+                                ai_response = "".join(parts)
+                                tool_used = done.get("tool_used")
+                                session_id = done.get("session_id")
+                            
+                                # Store the session ID for future requests
+                                if session_id:
+                                    set_session_id(session_id)
+                            
+                                if tool_used:
+                                    st.caption(f"🔧 Tool used: {tool_used}")
+                            
+                                # Add assistant message to chat history
+                                add_message("assistant", ai_response, tool_used)
+                                st.session_state.last_submit = (
+                                    idempotency_key, st.session_state.session_id, time.monotonic()
+                                )
+                            else:
+                                error_msg = f"Error: {stream_error}"
+                                st.error(error_msg)
+                                add_message("assistant", f"Sorry, I encountered an error: {error_msg}")
+                        else:
+                            response.read()
+                            error_msg = f"Error: {response.status_code} - {response.text}"
+                            st.error(error_msg)
+                            add_message("assistant", f"Sorry, I encountered an error: {error_msg}")
+                    
                 except httpx.ConnectError:
                     error_msg = "Cannot connect to the backend. Please make sure the backend service is running."
                     st.error(error_msg)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": error_msg
-                    })
+                    add_message("assistant", error_msg)
                 except Exception as e:
                     error_msg = f"An unexpected error occurred: {str(e)}"
                     st.error(error_msg)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": error_msg
-                    })
+                    add_message("assistant", error_msg)
+    
+        # Refresh the sidebar's session info in place; only a new session changes
+        # what the rest of the sidebar shows, so only then rerun the whole app
+        if st.session_state.session_id != session_before:
+            st.rerun()
+        render_session_info(session_info)
+
+@st.fragment
+def render_backend_status():
+    """Backend status panel; Recheck reruns only this fragment"""
+    # Backend status check (published by the background poller, no HTTP on rerun)
+    st.header("🔗 Backend Status")
+    panel = st.container()
+    health = get_health_monitor()
+    
+    # Recheck probes right away, before the panel above is filled in
+    if st.button("🔄 Recheck"):
+        _publish_health(health, _probe_backend(get_http_client()))
+    
+    status, checked_at = health["status"], health["checked_at"]
+    if status == "connected":
+        panel.success("✅ Backend Connected")
+        panel.caption(f"Last checked: {checked_at}")
+    elif status == "error":
+        panel.error("❌ Backend Error")
+    elif status == "disconnected":
+        panel.error("❌ Backend Disconnected")
+    else:
+        panel.info("Checking backend...")
+
+@st.fragment
+def render_server_history():
+    """Server history buttons; viewing history reruns only this fragment, not the chat"""
+    if not st.session_state.session_id:
+        return
+    
+    # Buttons only queue requests, which are sent together in one batch at the end of the pass
+    ops = {}
+    history_path = f"/chat/history/{st.session_state.session_id}"
+    if st.button("📊 View Server History"):
+        ops["history"] = lambda client: _fetch_history(client, history_path)
+    history_slot = st.empty()
+    
+    if st.button("🗑️ Clear Server History"):
+        ops["clear"] = lambda client: client.delete(history_path)
+    clear_slot = st.empty()
+    
+    if not ops:
+        return
+    
+    # Add a health probe to the batch (it runs in parallel) and publish it for the status panel
+    ops["health"] = lambda client: client.get("/health")
+    results = run_async(_submit_batch(get_async_client(), ops))
+    
+    _publish_health(get_health_monitor(), _health_status(results["health"]))
+    
+    if "history" in results:
+        history = results["history"]
+        if isinstance(history, httpx.HTTPStatusError):
+            history_slot.error("Failed to fetch server history")
+        elif isinstance(history, BaseException):
+            history_slot.error(f"Error: {str(history)}")
+        else:
+            history_slot.json(history)
+    
+    if "clear" in results:
+        response = results["clear"]
+        if isinstance(response, BaseException):
+            clear_slot.error(f"Error: {str(response)}")
+        elif response.status_code == 200:
+            clear_slot.success("Server history cleared!")
+            set_session_id(None)
+            clear_messages()
+            # The chat and session info live outside this fragment
+            st.rerun()
+        else:
+            clear_slot.error("Failed to clear server history")
 
+RESET_ACTIONS = ["Clear Chat", "New Session"]
+
+def _on_reset() -> None:
+    """Apply the picked reset action before the rerun, then clear the control's selection"""
+    action = st.session_state.reset_action
+    if action == "New Session":
+        set_session_id(None)
+    if action in RESET_ACTIONS:
+        clear_messages()
+    st.session_state.reset_action = None
+
+def main():
+    st.title("🤖 Financial AI Agent Chat")
+    st.markdown("Chat with your AI agent. Ask about currency rates or anything else!")
+    
+    # Initialize session state for chat history and session ID
+    init_messages()
+    if "session_id" not in st.session_state:
+        set_session_id(None)
+    
     with st.sidebar:
         st.header("Financial AI Agent")
         
         st.header("🛠️ Available Tools")
-        st.markdown("""
-        - **Currency Rates**: Real-time exchange rates from National Bank of Ukraine
-        - More tools to come
-        """)
+        st.markdown(AVAILABLE_TOOLS_MD)
 
         st.header("💬 Session Management")
-        if st.session_state.session_id:
-            st.success(f"Active Session: `{st.session_state.session_id[:8]}...`")
-            st.caption(f"Messages: {len(st.session_state.messages)}")
-        else:
-            st.info("No active session")
+        session_info = st.empty()
+        render_session_info(session_info)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("Clear Chat"):
-                st.session_state.messages = []
-                st.rerun()
-        
-        with col2:
-            if st.button("New Session"):
-                st.session_state.session_id = None
-                st.session_state.messages = []
-                st.rerun()
-        
-        # Session History Management
-        if st.session_state.session_id:
-            if st.button("📊 View Server History"):
-                try:
-                    response = httpx.get(f"{BACKEND_URL}/chat/history/{st.session_state.session_id}", timeout=10.0)
-                    if response.status_code == 200:
-                        data = response.json()
-                        st.json(data)
-                    else:
-                        st.error("Failed to fetch server history")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
-            
-            if st.button("🗑️ Clear Server History"):
-                try:
-                    response = httpx.delete(f"{BACKEND_URL}/chat/history/{st.session_state.session_id}", timeout=10.0)
-                    if response.status_code == 200:
-                        st.success("Server history cleared!")
-                        st.session_state.session_id = None
-                        st.session_state.messages = []
-                        st.rerun()
-                    else:
-                        st.error("Failed to clear server history")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+        # Resetting clears the chat, so this control stays outside the fragments and reruns the app
+        st.segmented_control("Reset", RESET_ACTIONS, key="reset_action", on_change=_on_reset)
         
-        # Backend status check
-        st.header("🔗 Backend Status")
-        try:
-            response = httpx.get(f"{BACKEND_URL}/health", timeout=5.0)
-            if response.status_code == 200:
-                st.success("✅ Backend Connected")
-                data = response.json()
-                st.caption(f"Last checked: {datetime.now().strftime('%H:%M:%S')}")
-            else:
-                st.error("❌ Backend Error")
-        except:
-            st.error("❌ Backend Disconnected")
+        render_server_history()
+        render_backend_status()
+    
+    render_chat(session_info)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file